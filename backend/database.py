@@ -1,8 +1,10 @@
 from sqlalchemy import create_engine, Column, String, Float, DateTime, Text, JSON
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import OperationalError
 from datetime import datetime, timezone
 import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,7 +12,16 @@ load_dotenv()
 # MySQL connection
 DATABASE_URL = os.environ.get('DATABASE_URL', 'mysql://root:@localhost/freshwater_fish_classification')
 
-engine = create_engine(DATABASE_URL, echo=False)
+# Reuse pooled connections across requests instead of reconnecting each time;
+# pre-ping drops connections MySQL closed after wait_timeout
+engine = create_engine(
+    DATABASE_URL,
+    echo=False,
+    pool_size=int(os.environ.get('DB_POOL_SIZE', 10)),
+    max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+    pool_pre_ping=True,
+    pool_recycle=3600,
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -39,9 +50,16 @@ class Classification(Base):
     species_id = Column(String(36), nullable=True)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
-# Create tables
-def init_db():
-    Base.metadata.create_all(bind=engine)
+# Create tables, retrying with exponential backoff while MySQL is still starting
+def init_db(retries=5, backoff=0.5):
+    for attempt in range(retries):
+        try:
+            Base.metadata.create_all(bind=engine)
+            return
+        except OperationalError:
+            if attempt == retries - 1:
+                raise
+            time.sleep(backoff * 2 ** attempt)
 
 # Get database session
 def get_db():
@@ -1,29 +1,53 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Depends
+from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Depends, Request, Response
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.datastructures import Headers
 from sqlalchemy.orm import Session
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import Dict, List, NamedTuple, Optional
 import uuid
+import hashlib
 from datetime import datetime, timezone
 import shutil
 import cv2
 import numpy as np
 from PIL import Image
 import io
+import asyncio
 import random
+import threading
+import time
 from database import get_db, init_db, FreshwaterSpecies as DBFreshwaterSpecies, Classification as DBClassification
 
+# orjson serializes responses much faster; fall back to stdlib json if absent
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as DefaultResponse
+except ImportError:
+    from fastapi.responses import JSONResponse as DefaultResponse
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
+
+# Configure logging before the model is loaded below, so its messages are kept
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
 logger = logging.getLogger(__name__)
 
 # Create the main app without a prefix
-app = FastAPI(title="Sistem Klasifikasi Ikan Air Tawar Pemancingan", version="1.0.0")
+app = FastAPI(
+    title="Sistem Klasifikasi Ikan Air Tawar Pemancingan",
+    version="1.0.0",
+    default_response_class=DefaultResponse,
+)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -33,8 +57,19 @@ api_router = APIRouter(prefix="/api")
 UPLOAD_DIR = Path(os.environ.get('UPLOAD_DIR', str(ROOT_DIR.parent / 'uploads')))
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
+MAX_UPLOAD_SIZE = 5 * 1024 * 1024  # 5MB
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Cap concurrent decode + inference jobs so bursts queue instead of
+# exhausting the threadpool and memory
+CLASSIFY_CONCURRENCY = int(os.environ.get('CLASSIFY_CONCURRENCY', 4))
+classify_semaphore = asyncio.Semaphore(CLASSIFY_CONCURRENCY)
+
+# Public URL prefix for files in UPLOAD_DIR
+UPLOAD_URL_PREFIX = "/uploads"
+
 # Mount static files
-app.mount("/uploads", StaticFiles(directory=str(UPLOAD_DIR)), name="uploads")
+app.mount(UPLOAD_URL_PREFIX, StaticFiles(directory=str(UPLOAD_DIR)), name="uploads")
 
 # Define Models
 class FreshwaterSpecies(BaseModel):
@@ -78,6 +113,9 @@ class SpeciesCreate(BaseModel):
     ukuran_avg: str
     gambar_contoh: str
 
+class HistoryBulkDelete(BaseModel):
+    ids: List[str] = Field(min_length=1, max_length=100)
+
 # CNN Model Class
 class FreshwaterCNN:
     def __init__(self, model_path=None):
@@ -97,22 +135,35 @@ class FreshwaterCNN:
         try:
             from tensorflow import keras
             self.model = keras.models.load_model(model_path)
+            self.warm_up()
             logger.info("Keras model loaded successfully")
         except Exception as e:
             logger.error(f"Failed to load model: {e}")
             self.model = None
 
-    def preprocess_image(self, image_bytes):
-        """Preprocess image for CNN input"""
+    def warm_up(self):
+        """Run one dummy prediction so the first request doesn't pay graph setup"""
+        dummy = np.zeros((1, *self.img_size, 3), dtype=np.float32)
+        self.model.predict(dummy, verbose=0)
+
+    def decode_image(self, image_bytes):
+        """Decode uploaded bytes into an RGB image"""
         image = Image.open(io.BytesIO(image_bytes))
+        # Let libjpeg downscale while decoding; large photos only need 224x224
+        image.draft('RGB', self.img_size)
         if image.mode != 'RGB':
             image = image.convert('RGB')
+        return image
 
+    def preprocess_image(self, image):
+        """Preprocess decoded image for CNN input"""
         # Resize to standard CNN input size
         image = image.resize(self.img_size)
 
-        # Convert to numpy array and normalize
-        img_array = np.array(image) / 255.0
+        # Normalize straight into float32 (the model's input dtype, matching
+        # rescale=1./255 in training) instead of a float64 temporary
+        img_array = np.asarray(image, dtype=np.float32)
+        img_array *= 1.0 / 255
 
         # Add batch dimension for model input
         img_array = np.expand_dims(img_array, axis=0)
@@ -145,16 +196,81 @@ MODEL_PATH = ROOT_DIR / 'models' / 'fish_classifier.h5'
 cnn_model = FreshwaterCNN(model_path=str(MODEL_PATH) if MODEL_PATH.exists() else None)
 
 # Helper Functions
-def create_thumbnail(image_path: Path, size=(150, 150)):
-    """Create thumbnail for uploaded image"""
-    thumb_path = image_path.parent / f"thumb_{image_path.name}"
-
-    with Image.open(image_path) as img:
-        img.thumbnail(size, Image.Resampling.LANCZOS)
-        img.save(thumb_path, "JPEG", quality=85)
+def create_thumbnail(image: Image.Image, thumb_path: Path, size=(150, 150)):
+    """Create thumbnail from an already decoded image"""
+    thumb = image.copy()
+    thumb.thumbnail(size, Image.Resampling.LANCZOS)
+    thumb.save(thumb_path, "JPEG", quality=85)
 
     return thumb_path
 
+# Species data rarely changes, so keep it in memory between requests.
+# Set SPECIES_CACHE_TTL=0 to always read from the database.
+SPECIES_CACHE_TTL = float(os.environ.get('SPECIES_CACHE_TTL', 60))
+
+class SpeciesSnapshot(NamedTuple):
+    species: List[FreshwaterSpecies]
+    etag: str
+    id_by_name: Dict[str, str]
+    by_id: Dict[str, FreshwaterSpecies]
+
+_species_cache = {"loaded_at": 0.0, "snapshot": None}
+_species_cache_lock = threading.Lock()
+
+def _fresh_snapshot() -> Optional[SpeciesSnapshot]:
+    snapshot = _species_cache["snapshot"]
+    if snapshot is not None and time.monotonic() - _species_cache["loaded_at"] < SPECIES_CACHE_TTL:
+        return snapshot
+    return None
+
+def _build_snapshot(species: List[FreshwaterSpecies]) -> SpeciesSnapshot:
+    # The ETag fingerprints the whole catalogue, so it changes whenever any species does.
+    # It is weak because /api responses may be sent gzip-encoded or not under one tag.
+    digest = hashlib.blake2b(digest_size=16)
+    id_by_name = {}
+    for item in species:
+        digest.update(item.model_dump_json().encode())
+        id_by_name.setdefault(item.nama_umum, item.id)
+    return SpeciesSnapshot(
+        species=species,
+        etag=f'W/"{digest.hexdigest()}"',
+        id_by_name=id_by_name,
+        by_id={item.id: item for item in species},
+    )
+
+def get_species_snapshot(db: Session) -> SpeciesSnapshot:
+    """Return the species catalogue, reloading from the database when the cache is stale"""
+    snapshot = _fresh_snapshot()
+    if snapshot is not None:
+        return snapshot
+
+    # Concurrent misses wait for a single reload instead of each querying the DB
+    with _species_cache_lock:
+        snapshot = _fresh_snapshot()
+        if snapshot is None:
+            rows = db.query(DBFreshwaterSpecies).all()
+            snapshot = _build_snapshot([FreshwaterSpecies.model_validate(row) for row in rows])
+            _species_cache["snapshot"] = snapshot
+            _species_cache["loaded_at"] = time.monotonic()
+        return snapshot
+
+def invalidate_species_cache():
+    """Force the next species lookup to hit the database"""
+    # Taking the lock waits out any in-flight reload, which may have queried
+    # before the change committed, so its stale snapshot is cleared too
+    with _species_cache_lock:
+        _species_cache["snapshot"] = None
+
+def not_modified(request: Request, etag: str) -> bool:
+    """Check whether the client already holds the representation tagged etag"""
+    # If-None-Match uses weak comparison: ignore W/ prefixes, match any listed tag or *
+    opaque_tag = etag.removeprefix("W/")
+    for candidate in request.headers.get("if-none-match", "").split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == opaque_tag:
+            return True
+    return False
+
 def init_sample_data(db: Session):
     """Initialize sample freshwater fishing fish data (4 species only)"""
     existing = db.query(DBFreshwaterSpecies).count()
@@ -210,56 +326,29 @@ def init_sample_data(db: Session):
 
     db.commit()
 
-# API Routes
-@api_router.get("/")
-async def root():
-    return {"message": "Sistem Klasifikasi Ikan Air Tawar Pemancingan API", "status": "aktif"}
-
-@api_router.get("/species", response_model=List[FreshwaterSpecies])
-async def get_all_species(db: Session = Depends(get_db)):
-    """Dapatkan semua jenis ikan air tawar"""
-    species_list = db.query(DBFreshwaterSpecies).all()
-    return species_list
-
-@api_router.get("/species/{species_id}", response_model=FreshwaterSpecies)
-async def get_species_detail(species_id: str, db: Session = Depends(get_db)):
-    """Dapatkan detail spesies berdasarkan ID"""
-    species = db.query(DBFreshwaterSpecies).filter(DBFreshwaterSpecies.id == species_id).first()
-    if not species:
-        raise HTTPException(status_code=404, detail="Spesies tidak ditemukan")
-    return species
-
-@api_router.post("/classify", response_model=ClassificationResponse)
-async def classify_fish(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    """Klasifikasi gambar ikan air tawar"""
-    # Validasi file
-    if not file.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="File harus berupa gambar")
-
-    # Check file size (5MB limit)
-    contents = await file.read()
-    if len(contents) > 5 * 1024 * 1024:  # 5MB
-        raise HTTPException(status_code=400, detail="Ukuran file maksimal 5MB")
-
+def process_classification(contents: bytes, filename: str, db: Session) -> ClassificationResponse:
+    """Save, classify and record an uploaded image (blocking, run in threadpool)"""
     # Save uploaded file
-    file_extension = Path(file.filename).suffix
+    file_extension = Path(filename).suffix
     unique_filename = f"{uuid.uuid4().hex}{file_extension}"
+    thumb_filename = f"thumb_{unique_filename}"
     file_path = UPLOAD_DIR / unique_filename
+    thumb_path = UPLOAD_DIR / thumb_filename
 
     with open(file_path, "wb") as buffer:
         buffer.write(contents)
 
-    # Create thumbnail
-    thumb_path = create_thumbnail(file_path)
-
     # Preprocess and classify
     try:
-        img_array = cnn_model.preprocess_image(contents)
+        # Decode once from memory; the thumbnail and CNN input share it
+        image = cnn_model.decode_image(contents)
+        create_thumbnail(image, thumb_path)
+
+        img_array = cnn_model.preprocess_image(image)
         predicted_type, confidence = cnn_model.predict(img_array)
 
-        # Find matching species in database
-        species = db.query(DBFreshwaterSpecies).filter(DBFreshwaterSpecies.nama_umum == predicted_type).first()
-        species_id = species.id if species else None
+        # Find matching species from the cached catalogue
+        species_id = get_species_snapshot(db).id_by_name.get(predicted_type)
 
         # Save classification result
         classification_id = str(uuid.uuid4())
@@ -281,8 +370,8 @@ async def classify_fish(file: UploadFile = File(...), db: Session = Depends(get_
             hasil_klasifikasi=predicted_type,
             tingkat_keyakinan=round(confidence, 2),
             species_id=species_id,
-            gambar_url=f"/uploads/{unique_filename}",
-            thumbnail_url=f"/uploads/thumb_{unique_filename}",
+            gambar_url=f"{UPLOAD_URL_PREFIX}/{unique_filename}",
+            thumbnail_url=f"{UPLOAD_URL_PREFIX}/{thumb_filename}",
             riwayat_id=classification_id
         )
 
@@ -290,18 +379,68 @@ async def classify_fish(file: UploadFile = File(...), db: Session = Depends(get_
         # Clean up files on error
         if file_path.exists():
             file_path.unlink()
-        if 'thumb_path' in locals() and thumb_path.exists():
+        if thumb_path.exists():
             thumb_path.unlink()
         raise HTTPException(status_code=500, detail=f"Error dalam klasifikasi: {str(e)}")
 
+# API Routes
+@api_router.get("/")
+async def root():
+    return {"message": "Sistem Klasifikasi Ikan Air Tawar Pemancingan API", "status": "aktif"}
+
+@api_router.get("/species", response_model=List[FreshwaterSpecies])
+def get_all_species(request: Request, response: Response, db: Session = Depends(get_db)):
+    """Dapatkan semua jenis ikan air tawar"""
+    snapshot = get_species_snapshot(db)
+    if not_modified(request, snapshot.etag):
+        return Response(status_code=304, headers={"ETag": snapshot.etag})
+    response.headers["ETag"] = snapshot.etag
+    return snapshot.species
+
+@api_router.get("/species/{species_id}", response_model=FreshwaterSpecies)
+def get_species_detail(species_id: str, request: Request, response: Response, db: Session = Depends(get_db)):
+    """Dapatkan detail spesies berdasarkan ID"""
+    snapshot = get_species_snapshot(db)
+    species = snapshot.by_id.get(species_id)
+    if not species:
+        raise HTTPException(status_code=404, detail="Spesies tidak ditemukan")
+    if not_modified(request, snapshot.etag):
+        return Response(status_code=304, headers={"ETag": snapshot.etag})
+    response.headers["ETag"] = snapshot.etag
+    return species
+
+@api_router.post("/classify", response_model=ClassificationResponse)
+async def classify_fish(file: UploadFile = File(...), db: Session = Depends(get_db)):
+    """Klasifikasi gambar ikan air tawar"""
+    # Validasi file
+    if not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="File harus berupa gambar")
+
+    # Check file size (5MB limit) while reading, so oversized uploads stop early
+    contents = bytearray()
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        contents.extend(chunk)
+        if len(contents) > MAX_UPLOAD_SIZE:
+            raise HTTPException(status_code=400, detail="Ukuran file maksimal 5MB")
+
+    # Decode, inference and DB writes are blocking; keep them off the event loop
+    async with classify_semaphore:
+        return await run_in_threadpool(process_classification, contents, file.filename, db)
+
 @api_router.get("/history", response_model=List[ClassificationResult])
-async def get_classification_history(db: Session = Depends(get_db)):
+def get_classification_history(db: Session = Depends(get_db)):
     """Dapatkan riwayat klasifikasi"""
-    history = db.query(DBClassification).order_by(DBClassification.created_at.desc()).limit(100).all()
+    # Plain column rows skip ORM instance construction and identity-map bookkeeping
+    history = (
+        db.query(*DBClassification.__table__.columns)
+        .order_by(DBClassification.created_at.desc())
+        .limit(100)
+        .all()
+    )
     return history
 
 @api_router.delete("/history/{classification_id}")
-async def delete_classification(classification_id: str, db: Session = Depends(get_db)):
+def delete_classification(classification_id: str, db: Session = Depends(get_db)):
     """Hapus riwayat klasifikasi"""
     result = db.query(DBClassification).filter(DBClassification.id == classification_id).delete()
     db.commit()
@@ -311,8 +450,23 @@ async def delete_classification(classification_id: str, db: Session = Depends(ge
 
     return {"message": "Riwayat berhasil dihapus"}
 
+@api_router.delete("/history")
+def delete_classifications(payload: HistoryBulkDelete, db: Session = Depends(get_db)):
+    """Hapus beberapa riwayat klasifikasi sekaligus"""
+    deleted = (
+        db.query(DBClassification)
+        .filter(DBClassification.id.in_(payload.ids))
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+
+    if deleted == 0:
+        raise HTTPException(status_code=404, detail="Riwayat tidak ditemukan")
+
+    return {"message": f"{deleted} riwayat berhasil dihapus", "jumlah_dihapus": deleted}
+
 @api_router.post("/species", response_model=FreshwaterSpecies)
-async def create_species(species_data: SpeciesCreate, db: Session = Depends(get_db)):
+def create_species(species_data: SpeciesCreate, db: Session = Depends(get_db)):
     """Tambah spesies baru (admin)"""
     species_id = str(uuid.uuid4())
     species = DBFreshwaterSpecies(
@@ -323,12 +477,35 @@ async def create_species(species_data: SpeciesCreate, db: Session = Depends(get_
     db.add(species)
     db.commit()
     db.refresh(species)
+    invalidate_species_cache()
 
     return species
 
 # Include the router in the main app
 app.include_router(api_router)
 
+# Room for multipart boundaries and headers around the file itself
+UPLOAD_REQUEST_OVERHEAD = 64 * 1024
+CLASSIFY_PATH = f"{api_router.prefix}/classify"
+
+class UploadSizeLimitMiddleware:
+    """Reject classify uploads whose declared size is over the limit before reading the body"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == CLASSIFY_PATH:
+            content_length = Headers(scope=scope).get("content-length", "")
+            if content_length.isdigit() and int(content_length) > MAX_UPLOAD_SIZE + UPLOAD_REQUEST_OVERHEAD:
+                response = DefaultResponse(status_code=400, content={"detail": "Ukuran file maksimal 5MB"})
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+# Registered before CORS so the early 400 still carries CORS headers
+app.add_middleware(UploadSizeLimitMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -337,12 +514,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+class APIGZipMiddleware:
+    """Gzip API responses only; files under /uploads are already-compressed images"""
+
+    def __init__(self, app, minimum_size=1000):
+        self.app = app
+        self.gzip_app = GZipMiddleware(app, minimum_size=minimum_size)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith(f"{api_router.prefix}/"):
+            await self.gzip_app(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+# Compress larger JSON payloads (species catalogue, history) on the wire
+app.add_middleware(APIGZipMiddleware, minimum_size=1000)
 
 @app.on_event("startup")
 async def startup_event():